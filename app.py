@@ -19,10 +19,14 @@ import os
 import sys
 import sqlite3
 import datetime
-import json
+import functools
+import hashlib
+import queue
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
-from PIL import Image, ImageOps
 import cv2
 
 # Attempt to import your real OMR processing module. If not available,
@@ -34,10 +38,11 @@ except Exception as e:
     HAS_OMR_MODULE = False
     # Simulated placeholders - **replace with your real functions**
     def get_answer_keys():
-        # Provide sample keys for sets A and B
+        # Provide sample keys for sets A and B as uint8 choice codes (A=0 .. D=3)
+        q = np.arange(1, 101) % 4
         return {
-            "SET-A": {i: "ABCD"[i % 4] for i in range(1, 101)},
-            "SET-B": {i: "DCBA"[i % 4] for i in range(1, 101)},
+            "SET-A": q.astype(np.uint8),
+            "SET-B": (3 - q).astype(np.uint8),
         }
 
     def find_and_warp_sheet(image_cv):
@@ -45,20 +50,24 @@ except Exception as e:
         # Replace with fiducial detection, contour-based warp, etc.
         return image_cv
 
-    def evaluate_sheet(warped_cv, answer_key):
+    # One local Generator: a single vectorized draw per sheet instead of
+    # six calls into the legacy global RNG
+    _rng = np.random.default_rng()
+
+    def evaluate_sheet(warped_cv, answer_key, in_place=False):
         # Simulate evaluation results structure the app expects.
         # Replace with actual bubble detection logic using OpenCV + ML classifier.
         num_questions = 100
-        subject_scores = [np.random.randint(10, 20) for _ in range(5)]
+        subject_scores = _rng.integers(10, 20, size=5).tolist()
         total_score = int(sum(subject_scores))
         # create a visualization overlay image (BGR)
-        vis = warped_cv.copy()
+        vis = warped_cv if in_place else warped_cv.copy()
         h, w = vis.shape[:2]
         cv2.putText(vis, "Simulated Result Overlay", (10, h - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
         return {
             "subject_scores": subject_scores,  # list of five integers 0-20
             "total_score": total_score,        # int 0-100
-            "ambiguous_questions": np.random.randint(0, 3),
+            "ambiguous_questions": int(_rng.integers(0, 3)),
             "visual_result": vis,              # BGR image for display
             "raw_answers": {i: "A" for i in range(1, num_questions+1)}  # dummy
         }
@@ -78,14 +87,6 @@ OUTPUT_DIR = os.path.join(APP_ROOT, "omr_outputs")
 DB_PATH = os.path.join(APP_ROOT, "evaluation_audit.db")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Initialize DB connection
-@st.cache_resource
-def init_db(path=DB_PATH):
-    conn = sqlite3.connect(path, check_same_thread=False)
-    return conn
-
-conn = init_db()
-
 def setup_database(connection):
     connection.execute('''
         CREATE TABLE IF NOT EXISTS results (
@@ -107,61 +108,306 @@ def setup_database(connection):
             rectified_path TEXT
         );
     ''')
+    # Partial index backing the Review section's "only flagged" filter
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_results_flagged ON results(flagged) WHERE flagged IS NOT NULL"
+    )
     connection.commit()
 
-setup_database(conn)
+# Initialize DB connection
+@st.cache_resource
+def init_db(path=DB_PATH):
+    # isolation_level=None: no implicit transactions from the sqlite3 module;
+    # bulk writes manage BEGIN/COMMIT themselves (see log_evaluations_bulk)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, detect_types=0)
+    # WAL + NORMAL sync: one fsync per checkpoint instead of two per commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")     # ~20 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")   # 256 MB memory-mapped reads
+    # Schema setup lives here so it runs once per process, not on every rerun
+    setup_database(conn)
+    return conn
+
+# The cached connection is shared by every session and runs in autocommit mode,
+# so explicit transactions on it must be serialized process-wide: a second
+# BEGIN while another session's batch is open would fail outright.
+@st.cache_resource
+def db_write_lock():
+    return threading.Lock()
+
+conn = init_db()
+
+# Helper: save image (BGR -> PNG) via libpng directly, no RGB copy.
+# Level 1: on noisy photographed sheets ~1.7x faster than 3 for ~4% larger files.
+PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
 
-# Helper: save image (BGR -> PNG)
 def save_bgr_image(bgr_img, path):
-    rgb = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
-    Image.fromarray(rgb).save(path, format="PNG")
-
-def timestamp_now():
-    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-
-# Logging function
-def log_evaluation_to_db(conn, results, meta):
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO results (
-            timestamp, filename, source, exam_set, total_score,
-            subj_python, subj_eda, subj_sql, subj_powerbi, subj_statistics,
-            ambiguous_questions, flagged, json_path, overlay_path, rectified_path
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    ''', (
+    if not cv2.imwrite(path, bgr_img, PNG_PARAMS):
+        raise IOError(f"cv2.imwrite could not write {path}")
+
+def encode_png(bgr_img):
+    ok, buf = cv2.imencode(".png", bgr_img, PNG_PARAMS)
+    if not ok:
+        raise ValueError("cv2.imencode could not encode PNG")
+    return buf.tobytes()
+
+# Preview images go to the browser as JPEG bytes: st.image passes encoded bytes
+# through as-is instead of converting BGR->RGB and PNG-encoding the array itself
+PREVIEW_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85]
+
+def encode_preview_jpeg(bgr_img):
+    ok, buf = cv2.imencode(".jpg", bgr_img, PREVIEW_JPEG_PARAMS)
+    if not ok:
+        raise ValueError("cv2.imencode could not encode JPEG")
+    return buf.tobytes()
+
+def decode_image_bytes(raw):
+    """
+    Decodes encoded image bytes (PNG/JPG) straight to a BGR ndarray.
+    `raw` may be bytes or a zero-copy memoryview (e.g. UploadedFile.getbuffer()).
+    """
+    img_bgr = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    if img_bgr is None:
+        raise ValueError("unsupported or corrupt image data")
+    return img_bgr
+
+# Long-side cap for sheets entering the pipeline: bubbles stay many pixels wide
+# at 1600 px, while 12 MP phone photos shrink ~6x before warp/evaluate.
+MAX_SHEET_SIDE = 1600
+
+# One reusable resize target per worker thread. Same-camera batches produce the
+# same downscaled shape, so after the first sheet resizes stop allocating.
+_scratch = threading.local()
+
+def scratch_buffer(shape):
+    """Per-thread uint8 buffer of `shape`; overwritten by the thread's next call."""
+    buf = getattr(_scratch, "buf", None)
+    if buf is None or buf.shape != shape:
+        buf = _scratch.buf = np.empty(shape, np.uint8)
+    return buf
+
+def limit_sheet_size(img_bgr, max_side=MAX_SHEET_SIDE, use_scratch=False):
+    """
+    Downscales (INTER_AREA) so the long side is at most max_side; never upscales.
+    With use_scratch=True a downscaled result lives in this thread's scratch_buffer:
+    callers must copy it if it outlives their next limit_sheet_size call.
+    """
+    h, w = img_bgr.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1.0:
+        return img_bgr
+    dsize = (max(1, round(w * scale)), max(1, round(h * scale)))
+    dst = scratch_buffer((dsize[1], dsize[0]) + img_bgr.shape[2:]) if use_scratch else None
+    return cv2.resize(img_bgr, dsize, dst=dst, interpolation=cv2.INTER_AREA)
+
+def is_pdf(upload):
+    """True if the upload's content starts with the PDF magic bytes (extension is ignored)."""
+    return upload.getbuffer()[:4].tobytes() == b"%PDF"
+
+def rasterize_pdf(raw, dpi=200, max_side=MAX_SHEET_SIDE):
+    """
+    Rasterizes every PDF page in-process with PyMuPDF; returns BGR ndarrays.
+    Pages are rendered at `dpi`, lowered per page so the long side fits `max_side`,
+    so they never need the post-decode downscale in process_single_image.
+    """
+    import pymupdf
+    pages = []
+    with pymupdf.open(stream=raw, filetype="pdf") as doc:
+        for page in doc:
+            page_dpi = int(min(dpi, max_side * 72 / max(page.rect.width, page.rect.height)))
+            pix = page.get_pixmap(dpi=page_dpi, colorspace=pymupdf.csRGB, alpha=False)
+            rgb = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+            pages.append(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    return pages
+
+def timestamp_now(now=None):
+    return (now or datetime.datetime.now()).strftime("%Y%m%d_%H%M%S")
+
+# Logging functions
+# Single module-level statement string: sqlite3 keys its prepared-statement
+# cache on the SQL text, so every batch reuses the same compiled INSERT.
+INSERT_RESULT_SQL = '''
+    INSERT INTO results (
+        timestamp, filename, source, exam_set, total_score,
+        subj_python, subj_eda, subj_sql, subj_powerbi, subj_statistics,
+        ambiguous_questions, flagged, json_path, overlay_path, rectified_path
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+'''
+
+def build_db_row(results, meta, ts):
+    """Flattens results + meta into a parameter tuple for the results INSERT."""
+    # Scores may arrive as a NumPy array; sqlite3 only binds plain Python ints
+    subject_scores = np.asarray(results.get("subject_scores")).tolist()
+    return (
         ts,
         meta.get("filename"),
         meta.get("source"),
         meta.get("exam_set"),
         results.get("total_score"),
-        results.get("subject_scores")[0],
-        results.get("subject_scores")[1],
-        results.get("subject_scores")[2],
-        results.get("subject_scores")[3],
-        results.get("subject_scores")[4],
+        subject_scores[0],
+        subject_scores[1],
+        subject_scores[2],
+        subject_scores[3],
+        subject_scores[4],
         results.get("ambiguous_questions"),
         results.get("flagged"),
         meta.get("json_path"),
         meta.get("overlay_path"),
         meta.get("rectified_path")
-    ))
-    conn.commit()
+    )
+
+def log_evaluations_bulk(conn, rows):
+    """
+    Inserts all rows of a batch inside a single transaction (one commit).
+    Rows must hold plain str/int/None values (timestamps pre-formatted).
+    """
+    if not rows:
+        return
+    with db_write_lock():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(INSERT_RESULT_SQL, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
 
 # Export helpers
-@st.cache_data
-def load_audit_df():
+AUDIT_COLUMNS = (
+    "id, timestamp, filename, exam_set, total_score, "
+    "subj_python, subj_eda, subj_sql, subj_powerbi, subj_statistics, "
+    "ambiguous_questions, flagged, overlay_path, rectified_path, json_path"
+)
+# On-screen audit table: artifact paths are only needed by Review and the exports
+AUDIT_TABLE_COLUMNS = (
+    "id, timestamp, filename, exam_set, total_score, "
+    "subj_python, subj_eda, subj_sql, subj_powerbi, subj_statistics, "
+    "ambiguous_questions, flagged"
+)
+AUDIT_ROW_LIMIT = 5000
+AUDIT_PAGE_SIZE = 500
+# Display labels for subj_* columns, in subject_scores order; built once as the chart index
+SUBJECT_INDEX = pd.Index(["Python", "EDA", "SQL", "Power BI", "Statistics"], name="Subject")
+
+def get_audit_max_id():
+    # Cheap change marker for the audit table; used as the load_audit_df cache key
     try:
-        df = pd.read_sql_query("SELECT * FROM results ORDER BY timestamp DESC", conn)
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM results").fetchone()[0]
+    except Exception:
+        return 0
+
+def query_df(sql, params=()):
+    """Runs a SELECT on the shared connection and assembles the DataFrame column-wise."""
+    cur = conn.execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+    if not rows:
+        return pd.DataFrame(columns=cols)
+    # Transpose once in C (zip) and hand pandas one sequence per column
+    return pd.DataFrame(dict(zip(cols, zip(*rows))))
+
+@st.cache_data(ttl=30)
+def load_audit_df(max_id, limit=AUDIT_ROW_LIMIT, offset=0, columns=AUDIT_COLUMNS):
+    # max_id is only a cache key: new inserts change it and invalidate the cache.
+    # ORDER BY id walks the primary key, so a page costs O(limit), not a table sort.
+    try:
+        df = query_df(
+            f"SELECT {columns} FROM results ORDER BY id DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        )
         return df
     except Exception:
         return pd.DataFrame()
 
+def load_audit_export_df(max_id):
+    # Full, unbounded audit table for the downloads: every column in schema order,
+    # so exported files keep a stable layout. Only called from the cached export
+    # builders below, so it runs once per audit state.
+    try:
+        return query_df("SELECT * FROM results ORDER BY id DESC")
+    except Exception:
+        return pd.DataFrame()
+
+@st.cache_data(ttl=30)
+def load_audit_stats(max_id):
+    # Dashboard KPIs and subject averages in a single scan of the results table
+    row = conn.execute('''
+        SELECT AVG(total_score), COUNT(*),
+               SUM(CASE WHEN flagged IS NOT NULL THEN 1 ELSE 0 END),
+               AVG(subj_python), AVG(subj_eda), AVG(subj_sql), AVG(subj_powerbi), AVG(subj_statistics)
+        FROM results
+    ''').fetchone()
+    return {
+        "avg_total": row[0],
+        "count": row[1],
+        "flagged": row[2],
+        # NULL averages (no rows) become NaN; aligned with SUBJECT_INDEX
+        "subject_averages": np.array(row[3:], dtype=np.float64),
+    }
+
+@st.cache_data(ttl=30)
+def load_review_df(max_id, flagged_only, search_term):
+    # Review filters evaluated in SQLite rather than on the full DataFrame
+    clauses, params = [], []
+    if flagged_only:
+        clauses.append("flagged IS NOT NULL")
+    if search_term:
+        # LIKE is case-insensitive for ASCII, matching the old str.contains(case=False)
+        escaped = search_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("filename LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    try:
+        return query_df(
+            f"SELECT {AUDIT_COLUMNS} FROM results {where} ORDER BY id DESC LIMIT {AUDIT_ROW_LIMIT}",
+            params
+        )
+    except Exception:
+        return pd.DataFrame()
+
+# Export payloads are built on download click and cached per audit state (max_id);
+# both export every row, not just the on-screen page.
+@st.cache_data(max_entries=4)
+def audit_csv_bytes(max_id):
+    # Encode straight into a bytes buffer; no intermediate str copy of the whole CSV
+    towrite = io.BytesIO()
+    load_audit_export_df(max_id).to_csv(towrite, index=False, encoding="utf-8")
+    return towrite.getvalue()
+
+@st.cache_data(max_entries=4)
+def audit_xlsx_bytes(max_id):
+    towrite = io.BytesIO()
+    with pd.ExcelWriter(towrite, engine="xlsxwriter") as writer:
+        load_audit_export_df(max_id).to_excel(writer, sheet_name="Audit", index=False)
+    return towrite.getvalue()
+
+@st.cache_resource
+def opencv_build_summary():
+    # Version + SIMD/IPP/parallel lines from cv2.getBuildInformation()
+    wanted = ("Version control:", "Baseline:", "Dispatched code generation:",
+              "Parallel framework:", "Intel IPP:", "NEON", "OpenCL:")
+    lines = [f"OpenCV {cv2.__version__}"]
+    lines += [line.strip() for line in cv2.getBuildInformation().splitlines()
+              if any(key in line for key in wanted)]
+    return "\n".join(lines)
+
+# Audit artifact loaders for the Review section; mtime is part of the cache key
+# so a rewritten file is re-read instead of served stale.
+@st.cache_data(max_entries=64)
+def load_audit_image(path, mtime):
+    return cv2.cvtColor(cv2.imread(path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+@st.cache_data(max_entries=64)
+def load_audit_file_bytes(path, mtime):
+    with open(path, "rb") as f:
+        return f.read()
+
 # ----------------------------------------------------------------------
 # Advanced CSS / Graphics (injected)
 # ----------------------------------------------------------------------
-st.markdown(
-    """
+APP_CSS = """
     <style>
     /* Page background and general typography */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;800&display=swap');
@@ -257,9 +503,11 @@ st.markdown(
     }
 
     </style>
-    """,
-    unsafe_allow_html=True
-)
+    """
+
+# Streamlit drops any element a rerun doesn't re-emit, so the <style> block must
+# be sent on every run; it cannot be injected once per session.
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # ----------------------------------------------------------------------
 # Page layout: Header (animated) + Controls
@@ -283,11 +531,24 @@ st.markdown(
 st.sidebar.header("⚙️ Evaluation Controls")
 
 # Load answer keys (from omr_processor or simulated fallback)
+# cache_resource (not cache_data): every rerun and session shares the same
+# read-only arrays instead of unpickling a fresh copy each time
+@st.cache_resource
+def load_answer_keys():
+    """Loads the keys once as read-only (100,) uint8 arrays (A=0 .. D=3)."""
+    keys = get_answer_keys()
+    arrays = {}
+    for set_name, key in keys.items():
+        arr = np.ascontiguousarray(key, dtype=np.uint8)
+        arr.flags.writeable = False
+        arrays[set_name] = arr
+    return arrays
+
 try:
-    ANSWER_KEYS = get_answer_keys()
+    ANSWER_KEYS = load_answer_keys()
 except Exception as e:
     st.sidebar.error("Could not load answer keys from omr_processor. Using simulated keys.")
-    ANSWER_KEYS = get_answer_keys()
+    ANSWER_KEYS = load_answer_keys()
 
 AVAILABLE_SETS = list(ANSWER_KEYS.keys()) if isinstance(ANSWER_KEYS, dict) else ["SET-A", "SET-B"]
 exam_set_choice = st.sidebar.selectbox("1. Select Exam Set / Version", options=AVAILABLE_SETS)
@@ -305,6 +566,7 @@ else:
 flagging_threshold = st.sidebar.slider("Flag evaluation if ambiguous questions ≥", min_value=0, max_value=10, value=1)
 low_score_flag_threshold = st.sidebar.slider("Flag if total score ≤", min_value=0, max_value=100, value=10)
 save_rectified = st.sidebar.checkbox("Save rectified images & overlays to audit folder", value=True)
+st.sidebar.checkbox("Celebrate completed batches 🎈", value=False, key="celebrate")
 
 # ----------------------------------------------------------------------
 # Main: Actions & pipeline
@@ -315,6 +577,7 @@ with col1:
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.subheader("Upload / Scan")
     st.write("Choose OMR images (batch) or use camera. Click **Start Evaluation** to run the pipeline.")
+    st.caption(f"Sheets are processed at up to {MAX_SHEET_SIDE} px on the long edge; larger photos are downscaled.")
     num_files = len(uploaded_files) if uploaded_files else (1 if camera_capture else 0)
     st.markdown(f"**Queued files:** {num_files}")
 
@@ -332,15 +595,62 @@ with col2:
 # ----------------------------------------------------------------------
 # Evaluation loop (batch or single)
 # ----------------------------------------------------------------------
-def process_single_image(pil_img, filename_hint, exam_set):
+# Artifact disk writes run on one background thread per batch, fed through a
+# bounded queue so compute never waits on I/O (and memory stays capped).
+ARTIFACT_QUEUE_SIZE = 8
+
+def write_artifacts(job):
+    """Writes one sheet's JSON + PNG artifacts; returns {path: error} for failed writes."""
+    failures = {}
+    # Pre-encoded payloads (JSON, rectified PNG) are written as-is
+    for path, payload in job["files"]:
+        try:
+            with open(path, "wb") as f:
+                f.write(payload)
+        except Exception as e:
+            failures[path] = e
+    for path, bgr_img in job["images"]:
+        try:
+            save_bgr_image(bgr_img, path)
+        except Exception as e:
+            failures[path] = e
+    return failures
+
+def artifact_writer_loop(artifact_queue, failures):
+    # Drains the queue until the None sentinel; failures are merged for the caller
+    while True:
+        job = artifact_queue.get()
+        if job is None:
+            break
+        failures.update(write_artifacts(job))
+
+def image_digest(image):
+    """blake2b digest of a sheet's encoded bytes (or rasterized page pixels + shape)."""
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(image, np.ndarray):
+        h.update(repr(image.shape).encode())
+        image = np.ascontiguousarray(image)
+    h.update(image)
+    return h.hexdigest()
+
+# Re-uploading the same sheet (common while tuning sliders) skips decode, warp
+# and evaluation. Keyed on the content digest; `_image` itself is not hashed.
+# Entries hold a full overlay image, hence the modest max_entries.
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def evaluate_image_cached(image_digest, exam_set, with_rectified, _image):
     """
-    Processes a single PIL image: runs warp, evaluate, saves artifacts and logs.
-    Returns results dict and paths.
+    Decode -> downscale -> warp -> evaluate for one sheet.
+    Returns (results, warped sheet with overlay, rectified PNG bytes or None,
+    list of (level, message) notices); messages hold a "{name}" placeholder
+    for the caller to fill in.
     """
-    # Convert PIL to BGR (OpenCV)
-    img_rgb = pil_img.convert("RGB")
-    img_np = np.array(img_rgb)
-    img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+    notices = []
+
+    # Encoded uploads are decoded here on the worker thread: decode runs in parallel
+    # and only in-flight sheets are held as full-size BGR arrays
+    decoded = _image if isinstance(_image, np.ndarray) else decode_image_bytes(_image)
+    # The downscaled copy is normally only read by the warp, so it goes into scratch
+    img_bgr = limit_sheet_size(decoded, use_scratch=True)
 
     # Attempt to detect & warp the sheet
     try:
@@ -348,18 +658,51 @@ def process_single_image(pil_img, filename_hint, exam_set):
         if warped is None:
             raise ValueError("Warp returned None")
     except Exception as e:
-        # If sheet detection fails, mark as failed and still save original
-        warped = img_bgr.copy()
+        # If sheet detection fails, mark as failed and still save original.
+        warped = img_bgr
         # In production, you'd want to return an explicit failure/flag for manual review
-        st.warning(f"Sheet detection warning for {filename_hint}: {e}")
+        notices.append(("warning", f"Sheet detection warning for {{name}}: {e}"))
+    # The result is kept and drawn on. If it is (or views, e.g. a crop of) the
+    # scratch buffer, the next sheet would overwrite it, so copy it out.
+    if img_bgr is not decoded and np.shares_memory(warped, img_bgr):
+        warped = warped.copy()
+
+    # The overlay is drawn in place on `warped`, so the clean rectified sheet is
+    # PNG-encoded first; nothing below may rely on `warped` being undrawn.
+    rectified_png = None
+    if with_rectified:
+        try:
+            rectified_png = encode_png(warped)
+        except Exception as e:
+            notices.append(("warning", f"Failed to encode rectified image for {{name}}: {e}"))
 
     answer_key = ANSWER_KEYS.get(exam_set)
     try:
-        results = evaluate_sheet(warped.copy(), answer_key)
+        results = evaluate_sheet(warped, answer_key, in_place=True)
     except Exception as e:
         # fallback simulated evaluation in case real evaluate fails
-        st.error(f"Evaluation routine raised error for {filename_hint}. Using fallback eval. Error: {e}")
-        results = evaluate_sheet(warped.copy(), answer_key)
+        notices.append(("error", f"Evaluation routine raised error for {{name}}. Using fallback eval. Error: {e}"))
+        results = evaluate_sheet(warped, answer_key, in_place=True)
+
+    return results, warped, rectified_png, notices
+
+def process_single_image(image, filename_hint, exam_set, batch_now, seq, artifact_queue):
+    """
+    Processes a single sheet: decodes, runs warp + evaluate and queues its artifacts.
+    `image` is either a BGR ndarray (rasterized PDF page) or encoded image bytes.
+    `batch_now` is the batch start time and `seq` the sheet's index in the batch;
+    together they give every artifact a unique name without per-sheet clock reads.
+    Returns results dict, meta and a list of (level, message) notices.
+
+    Runs on worker threads, so it must not touch `st.*` or the DB connection:
+    notices are rendered and DB logging is batched by the caller. Artifacts are
+    written by the batch's writer thread; meta paths are final only once it is joined.
+    """
+    # Cached per image content: cache hits come back as fresh copies, so the
+    # flag/meta fields set below never leak into the cache
+    results, warped, rectified_png, cached_notices = evaluate_image_cached(
+        image_digest(image), exam_set, save_rectified, image)
+    notices = [(level, message.replace("{name}", filename_hint)) for level, message in cached_notices]
 
     # Determine flagged reason
     flag_reason = None
@@ -371,7 +714,7 @@ def process_single_image(pil_img, filename_hint, exam_set):
     results['flagged'] = flag_reason
 
     # Save artifacts
-    base_name = f"{timestamp_now()}__{filename_hint.replace(' ', '_')}"
+    base_name = f"{timestamp_now(batch_now)}_{seq:05d}__{filename_hint.replace(' ', '_')}"
     json_path = os.path.join(OUTPUT_DIR, base_name + ".json")
     overlay_path = os.path.join(OUTPUT_DIR, base_name + "_overlay.png")
     rectified_path = os.path.join(OUTPUT_DIR, base_name + "_rectified.png")
@@ -379,7 +722,7 @@ def process_single_image(pil_img, filename_hint, exam_set):
     # Save JSON results
     to_dump = {
         "metadata": {
-            "processed_at": datetime.datetime.now().isoformat(),
+            "processed_at": batch_now.isoformat(),
             "source_filename": filename_hint,
             "exam_set": exam_set
         },
@@ -391,72 +734,60 @@ def process_single_image(pil_img, filename_hint, exam_set):
             "raw_answers": results.get("raw_answers", {})
         }
     }
-    with open(json_path, "w", encoding="utf8") as f:
-        json.dump(to_dump, f, indent=2)
-
-    # Save overlay and rectified images if requested
-    try:
-        if save_rectified:
-            # rectified = warped (BGR)
-            save_bgr_image(warped, rectified_path)
-            # overlay visualization (BGR) - use results['visual_result'] if available
-            if results.get("visual_result") is not None:
-                save_bgr_image(results["visual_result"], overlay_path)
-            else:
-                # fallback: use the rectified image as overlay
-                save_bgr_image(warped, overlay_path)
-    except Exception as e:
-        st.warning(f"Failed to save artifacts for {filename_hint}: {e}")
+    # raw_answers is keyed by int question number, hence OPT_NON_STR_KEYS
+    json_bytes = orjson.dumps(
+        to_dump, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+    # Overlay and rectified images if requested
+    files = [(json_path, json_bytes)]
+    images = []
+    if save_rectified:
+        if rectified_png is not None:
+            files.append((rectified_path, rectified_png))
+        # overlay visualization (BGR) - use results['visual_result'] if available,
+        # falling back to the (drawn-on) warped sheet
+        overlay = results.get("visual_result")
+        images.append((overlay_path, overlay if overlay is not None else warped))
+    artifact_queue.put({"files": files, "images": images})
 
     meta = {
         "filename": filename_hint,
         "source": filename_hint,
         "exam_set": exam_set,
         "json_path": json_path,
-        "overlay_path": overlay_path if os.path.exists(overlay_path) else "",
-        "rectified_path": rectified_path if os.path.exists(rectified_path) else ""
+        "overlay_path": overlay_path if save_rectified else "",
+        "rectified_path": rectified_path if rectified_png is not None else ""
     }
 
-    # Log to DB
-    log_evaluation_to_db(conn, results, meta)
-
-    return results, meta
+    return results, meta, notices
 
 # Running the pipeline
 if process_button:
+    # One clock read per batch, reused for artifact names, JSON metadata and DB rows
+    batch_now = datetime.datetime.now()
     files_to_process = []
-    # Prepare list of (PIL Image, filename) tuples
+    # Prepare list of (BGR ndarray or encoded bytes, filename) tuples
     if input_method == "File Uploader (batch)":
         if not uploaded_files:
             st.sidebar.warning("Please upload at least one file.")
         else:
-            # Accept PDFs: attempt to read each page if needed (simple handling)
+            # Route by content: PDFs are rasterized once here (one entry per page),
+            # images are queued as encoded bytes for the workers to decode
             for file in uploaded_files:
                 name = file.name
-                if name.lower().endswith(".pdf"):
+                if is_pdf(file):
                     try:
-                        from pdf2image import convert_from_bytes
-                        pages = convert_from_bytes(file.read(), dpi=200)
+                        pages = rasterize_pdf(file.getvalue(), dpi=200)
                         for pidx, page in enumerate(pages):
                             files_to_process.append((page, f"{name}_page{pidx+1}"))
                     except Exception as e:
-                        st.warning(f"Could not convert PDF {name}: {e}")
-                        # attempt to read as image directly
-                        try:
-                            img = Image.open(file)
-                            files_to_process.append((img, name))
-                        except Exception as ex:
-                            st.error(f"Could not read file {name}: {ex}")
+                        st.error(f"Could not convert PDF {name}: {e}")
                 else:
-                    try:
-                        img = Image.open(file)
-                        files_to_process.append((img, name))
-                    except Exception as e:
-                        st.error(f"Could not open {name}: {e}")
+                    files_to_process.append((file.getbuffer(), name))
     else:
         if camera_capture:
-            img = Image.open(camera_capture)
-            files_to_process.append((img, f"camera_{timestamp_now()}.png"))
+            files_to_process.append((camera_capture.getbuffer(), f"camera_{timestamp_now(batch_now)}.png"))
         else:
             st.sidebar.warning("No camera capture taken.")
 
@@ -467,20 +798,66 @@ if process_button:
         status_placeholder.info(f"Starting evaluation for {total} file(s)...")
         progress_bar = st.progress(0)
         results_records = []
-        for idx, (pil_img, fname) in enumerate(files_to_process, start=1):
-            status_placeholder.info(f"Processing ({idx}/{total}): {fname}")
-            try:
-                res, meta = process_single_image(pil_img, fname, exam_set_choice)
-                results_records.append((res, meta))
-                # show visual overlay for last processed
-                if res.get("visual_result") is not None:
-                    rgb = cv2.cvtColor(res["visual_result"], cv2.COLOR_BGR2RGB)
-                    visual_preview.image(rgb, caption=f"Overlay: {fname}", use_column_width=True)
-            except Exception as e:
-                st.error(f"Failed processing {fname}: {e}")
-            progress_bar.progress(int((idx/total)*100))
+        batch_ts = batch_now.strftime("%Y-%m-%d %H:%M:%S")
+        artifact_queue = queue.Queue(maxsize=ARTIFACT_QUEUE_SIZE)
+        artifact_failures = {}
+        writer = threading.Thread(target=artifact_writer_loop, args=(artifact_queue, artifact_failures), daemon=True)
+        writer.start()
+        # OpenCV releases the GIL, so sheets warp/evaluate concurrently on a thread pool;
+        # all st.* updates and DB writes stay on this (script) thread.
+        try:
+            with ThreadPoolExecutor(max_workers=min(total, os.cpu_count() or 1)) as executor:
+                futures = {
+                    executor.submit(process_single_image, image, fname, exam_set_choice,
+                                    batch_now, seq, artifact_queue): (seq, fname)
+                    for seq, (image, fname) in enumerate(files_to_process, start=1)
+                }
+                for idx, future in enumerate(as_completed(futures), start=1):
+                    seq, fname = futures[future]
+                    status_placeholder.info(f"Processed ({idx}/{total}): {fname}")
+                    try:
+                        res, meta, notices = future.result()
+                        for level, message in notices:
+                            getattr(st, level)(message)
+                        results_records.append((seq, res, meta))
+                    except Exception as e:
+                        st.error(f"Failed processing {fname}: {e}")
+                    progress_bar.progress(int((idx/total)*100))
+        finally:
+            status_placeholder.info("Finishing artifact writes...")
+            artifact_queue.put(None)
+            writer.join()
+
+        # Workers finish in any order; restore upload order so audit ids, the
+        # "most recent first" listing and the preview's last sheet follow it
+        results_records.sort(key=lambda record: record[0])
+        results_records = [(res, meta) for _, res, meta in results_records]
+
+        # show visual overlay for last processed (one image push per batch, not per sheet)
+        if results_records:
+            last_res, last_meta = results_records[-1]
+            if last_res.get("visual_result") is not None:
+                visual_preview.image(encode_preview_jpeg(last_res["visual_result"]),
+                                     caption=f"Overlay: {last_meta['filename']}", use_column_width=True)
+
+        # Artifacts are on disk now: drop paths that failed to write, then build DB rows
+        db_rows = []
+        for res, meta in results_records:
+            for key in ("json_path", "overlay_path", "rectified_path"):
+                if meta[key] in artifact_failures:
+                    st.warning(f"Failed to save {os.path.basename(meta[key])} for {meta['filename']}: "
+                               f"{artifact_failures[meta[key]]}")
+                    meta[key] = ""
+            db_rows.append(build_db_row(res, meta, batch_ts))
+        # Log the whole batch to DB in one transaction
+        try:
+            log_evaluations_bulk(conn, db_rows)
+        except Exception as e:
+            st.error(f"Failed to log evaluations to audit DB: {e}")
         status_placeholder.success(f"Completed evaluation for {total} files. Saved to audit folder: {OUTPUT_DIR}")
-        st.balloons()
+        # Opt-in only: the animation is extra client work after every batch
+        if st.session_state.get("celebrate", False):
+            st.balloons()
 
 # ----------------------------------------------------------------------
 # Results / Audit Dashboard
@@ -488,46 +865,38 @@ if process_button:
 st.markdown("<br />")
 st.markdown("<div class='card'>", unsafe_allow_html=True)
 st.subheader("📊 Audit Log & Analytics")
-audit_df = load_audit_df()
-if audit_df.empty:
+audit_max_id = get_audit_max_id()
+stats = load_audit_stats(audit_max_id)
+if stats["count"] == 0:
     st.info("No evaluations recorded yet. Run some evaluations to populate the audit log.")
 else:
     st.write("Recent evaluations (most recent first):")
-    st.dataframe(audit_df, use_container_width=True)
-
-    # Download CSV & Excel
-    csv_bytes = audit_df.to_csv(index=False).encode("utf-8")
-    st.download_button("📥 Download Audit CSV", data=csv_bytes, file_name=f"audit_log_{timestamp_now()}.csv", mime="text/csv")
+    num_pages = -(-stats["count"] // AUDIT_PAGE_SIZE)
+    page = 1
+    if num_pages > 1:
+        page = st.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, value=1)
+    page_df = load_audit_df(audit_max_id, AUDIT_PAGE_SIZE, (page - 1) * AUDIT_PAGE_SIZE, AUDIT_TABLE_COLUMNS)
+    st.dataframe(page_df, use_container_width=True)
+
+    # Download CSV & Excel. Callable data is only built when the button is
+    # clicked, so reruns (e.g. right after a batch) never serialize the history.
+    st.download_button("📥 Download Audit CSV", data=functools.partial(audit_csv_bytes, audit_max_id), file_name=f"audit_log_{timestamp_now()}.csv", mime="text/csv")
     # Excel
-    towrite = io.BytesIO()
-    with pd.ExcelWriter(towrite, engine="xlsxwriter") as writer:
-        audit_df.to_excel(writer, sheet_name="Audit", index=False)
-        writer.save()
-    st.download_button("📥 Download Audit Excel", data=towrite.getvalue(), file_name=f"audit_log_{timestamp_now()}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    st.download_button("📥 Download Audit Excel", data=functools.partial(audit_xlsx_bytes, audit_max_id), file_name=f"audit_log_{timestamp_now()}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
-    # Quick analytics
+    # Quick analytics (one aggregate query over the full table)
     st.markdown("#### Aggregate Metrics")
     colA, colB, colC = st.columns(3)
     with colA:
-        st.markdown(f"<div class='big-number'>{int(audit_df['total_score'].mean()):d}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='big-number'>{int(stats['avg_total'] or 0):d}</div>", unsafe_allow_html=True)
         st.caption("Average Total Score")
     with colB:
-        st.metric("Evaluations", value=len(audit_df))
+        st.metric("Evaluations", value=stats["count"])
     with colC:
-        num_flagged = audit_df['flagged'].notnull().sum()
-        st.metric("Flagged for Review", value=int(num_flagged))
+        st.metric("Flagged for Review", value=int(stats["flagged"] or 0))
 
     # Subject averages chart
-    subject_cols = ["subj_python", "subj_eda", "subj_sql", "subj_powerbi", "subj_statistics"]
-    if set(subject_cols).issubset(audit_df.columns):
-        averages = audit_df[subject_cols].mean().rename(index={
-            "subj_python": "Python",
-            "subj_eda": "EDA",
-            "subj_sql": "SQL",
-            "subj_powerbi": "Power BI",
-            "subj_statistics": "Statistics"
-        })
-        st.bar_chart(averages)
+    st.bar_chart(pd.Series(stats["subject_averages"], index=SUBJECT_INDEX, name="Average Score"))
 
 st.markdown("</div>", unsafe_allow_html=True)
 
@@ -541,14 +910,12 @@ st.write("Search by filename or view flagged records for manual review.")
 search_term = st.text_input("Filename contains...")
 filter_flagged = st.checkbox("Show only flagged records", value=False)
 
-df = load_audit_df()
-if not df.empty:
-    if filter_flagged:
-        df_view = df[df['flagged'].notnull()]
+if stats["count"] > 0:
+    if filter_flagged or search_term:
+        df_view = load_review_df(audit_max_id, filter_flagged, search_term)
     else:
-        df_view = df
-    if search_term:
-        df_view = df_view[df_view['filename'].str.contains(search_term, case=False, na=False)]
+        # Unfiltered: the most recent page, with artifact paths for the image viewer
+        df_view = load_audit_df(audit_max_id, AUDIT_PAGE_SIZE, 0)
     if df_view.empty:
         st.info("No records match the filter.")
     else:
@@ -567,11 +934,14 @@ if not df.empty:
         # show overlay and rectified images if present
         with st.expander("Images"):
             if rec.get("overlay_path") and os.path.exists(rec["overlay_path"]):
-                st.image(rec["overlay_path"], caption="Overlay Visualization", use_column_width=True)
+                img = load_audit_image(rec["overlay_path"], os.path.getmtime(rec["overlay_path"]))
+                st.image(img, caption="Overlay Visualization", use_column_width=True)
             if rec.get("rectified_path") and os.path.exists(rec["rectified_path"]):
-                st.image(rec["rectified_path"], caption="Rectified Sheet", use_column_width=True)
+                img = load_audit_image(rec["rectified_path"], os.path.getmtime(rec["rectified_path"]))
+                st.image(img, caption="Rectified Sheet", use_column_width=True)
             if rec.get("json_path") and os.path.exists(rec["json_path"]):
-                st.download_button("Download JSON result", data=open(rec["json_path"], "rb").read(), file_name=os.path.basename(rec["json_path"]))
+                json_bytes = load_audit_file_bytes(rec["json_path"], os.path.getmtime(rec["json_path"]))
+                st.download_button("Download JSON result", data=json_bytes, file_name=os.path.basename(rec["json_path"]))
 st.markdown("</div>", unsafe_allow_html=True)
 
 # ----------------------------------------------------------------------
@@ -604,5 +974,8 @@ if st.sidebar.checkbox("Show developer notes / judges checklist", value=False):
     - ⚠️ **Accuracy target**: For <0.5% error tolerance, fine-tune the classical CV thresholds and train a small ML classifier (scikit-learn or TensorFlow Lite) for ambiguous-mark classification. Use a labeled dataset from sample scans.  
     - Suggested improvements: background job queue (Celery/RQ) for very large batches, S3/object storage for outputs in multi-instance deployments, HTTPS + authentication for evaluator access, role-based audit controls.
     """)
+    # Confirms the deployed OpenCV ships the SIMD/IPP kernels the pipeline relies on
+    st.markdown("#### OpenCV build")
+    st.code(opencv_build_summary())
 
 # EOF
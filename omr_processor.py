@@ -4,28 +4,38 @@
 import numpy as np
 import cv2
 
+# Answer-key arrays hold choice codes: index into this to get the letter back
+ANSWER_CHOICES = np.array(list("ABCD"))
+
+# Question q's answer is at index q-1
+NUM_QUESTIONS = 100
+
+# Sample key cycling A, B, C, D; built once at import and shared read-only
+_CYCLIC_KEY = np.frombuffer(b"ABCD" * (NUM_QUESTIONS // 4), dtype=np.uint8) - ord("A")
+_CYCLIC_KEY.flags.writeable = False
+
 def get_answer_keys():
-    keys = {}
-    for set_name in ["SET-A", "SET-B"]:
-        d = {}
-        for i in range(1, 101):
-            d[i] = ["A","B","C","D"][(i-1) % 4]
-        keys[set_name] = d
-    return keys
+    # {set name: (100,) uint8 choice-code array}, A=0 .. D=3
+    return {"SET-A": _CYCLIC_KEY, "SET-B": _CYCLIC_KEY}
 
 def find_and_warp_sheet(image_bgr):
     return image_bgr
 
-def evaluate_sheet(warped_bgr, answer_key):
+def evaluate_sheet(warped_bgr, answer_key, in_place=False):
+    # answer_key: (100,) uint8 array of choice codes (A=0 .. D=3), index q-1 is question q
+    # in_place=True draws the overlay directly onto warped_bgr (no full-sheet copy);
+    # callers that still need the clean sheet must encode/copy it beforehand.
     h, w = warped_bgr.shape[:2]
     rng = np.random.RandomState((h + w) % 100)
-    subject_scores = [int(rng.randint(10, 20)) for _ in range(5)]
-    total_score = sum(subject_scores)
+    # Scores stay a NumPy array (one draw, one reduction): real bubble scoring
+    # slots in as correct.reshape(5, 20).sum(axis=1) without a Python loop
+    subject_scores = rng.randint(10, 20, size=5).astype(np.int32)
+    total_score = int(subject_scores.sum())
     ambiguous = int(rng.randint(0, 2))
-    vis = warped_bgr.copy()
+    vis = warped_bgr if in_place else warped_bgr.copy()
     cv2.putText(vis, f"Simulated Score: {total_score}/100", (30, 40),
                 cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,255,0), 2, cv2.LINE_AA)
-    raw_answers = {i: answer_key.get(i, "A") for i in range(1, 101)}
+    raw_answers = dict(enumerate(ANSWER_CHOICES[answer_key].tolist(), start=1))
     return {
         "subject_scores": subject_scores,
         "total_score": total_score,